@@ -6,9 +6,21 @@ import os
 import types
 from contextlib import contextmanager
 from concurrent.futures import ThreadPoolExecutor as DefaultThreadPoolExecutor
-from threadlet import SimpleThreadPoolExecutor, spawn, ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor
+from threadlet import (
+    SimpleThreadPoolExecutor,
+    spawn,
+    ThreadPoolExecutor,
+    InterpreterPoolExecutor,
+    InterpretersNotSupported,
+    Future,
+    chain,
+)
 
 N = int(os.getenv("N", 1_000_000))
+CPU_N = int(os.getenv("CPU_N", 64))
+PIPELINE_N = int(os.getenv("PIPELINE_N", 100_000))
+STAGES = 5
 
 
 @contextmanager
@@ -56,17 +68,22 @@ def dummy():
     pass
 
 
-for cls in [DefaultThreadPoolExecutor, ThreadPoolExecutor, SimpleThreadPoolExecutor]:
-    res = {}
-    for tracer in (trace_time, trace_memory):
-        with nogc(), tracer() as t:
-            with cls(1) as tpe:
-                for _ in range(N):
-                    tpe.submit(dummy)
-            gc.collect()
-        res[tracer] = t.result
-    prefix = f"{cls_name(cls)} submit"
-    print(f"{prefix:>51}: {res[trace_time]} {res[trace_memory]}")
+def bench_submit():
+    for cls in [
+        DefaultThreadPoolExecutor,
+        ThreadPoolExecutor,
+        SimpleThreadPoolExecutor,
+    ]:
+        res = {}
+        for tracer in (trace_time, trace_memory):
+            with nogc(), tracer() as t:
+                with cls(1) as tpe:
+                    for _ in range(N):
+                        tpe.submit(dummy)
+                gc.collect()
+            res[tracer] = t.result
+        prefix = f"{cls_name(cls)} submit"
+        print(f"{prefix:>51}: {res[trace_time]} {res[trace_memory]}")
 
 
 def consume(q):
@@ -77,27 +94,102 @@ def consume(q):
         f.result()
 
 
-for max_workers in (1, 2, 4, 8):
-    q: queue.SimpleQueue = queue.SimpleQueue()
-    for cls in [
-        DefaultThreadPoolExecutor,
-        ThreadPoolExecutor,
-        SimpleThreadPoolExecutor,
-    ]:
-        res = {}
-        for tracer in (trace_time, trace_memory):
-            with cls(max_workers) as executor:
-                with tracer() as t:
-                    consumer = spawn(consume, q)
-                    for i in range(N):
-                        q.put(executor.submit(dummy))
-                        if tracer is trace_memory and 0 < i < N and i % 100_000 == 0:
-                            time.sleep(1.5)
-                    q.put(None)
-                    consumer.result()
-                    if tracer is trace_memory:
-                        time.sleep(2)
-                    gc.collect()
-                res[tracer] = t.result
-        prefix = f"{cls_name(cls)} e2e[{max_workers}]"
-        print(f"{prefix:>51}: {res[trace_time]} {res[trace_memory]}")
+def bench_e2e():
+    for max_workers in (1, 2, 4, 8):
+        q: queue.SimpleQueue = queue.SimpleQueue()
+        for cls in [
+            DefaultThreadPoolExecutor,
+            ThreadPoolExecutor,
+            SimpleThreadPoolExecutor,
+        ]:
+            res = {}
+            for tracer in (trace_time, trace_memory):
+                with cls(max_workers) as executor:
+                    with tracer() as t:
+                        consumer = spawn(consume, q)
+                        for i in range(N):
+                            q.put(executor.submit(dummy))
+                            if (
+                                tracer is trace_memory
+                                and 0 < i < N
+                                and i % 100_000 == 0
+                            ):
+                                time.sleep(1.5)
+                        q.put(None)
+                        consumer.result()
+                        if tracer is trace_memory:
+                            time.sleep(2)
+                        gc.collect()
+                    res[tracer] = t.result
+            prefix = f"{cls_name(cls)} e2e[{max_workers}]"
+            print(f"{prefix:>51}: {res[trace_time]} {res[trace_memory]}")
+
+
+def fib(n):
+    return n if n < 2 else fib(n - 1) + fib(n - 2)
+
+
+def bench_cpu():
+    from benchmarks import fib  # importable by name from other interpreters/processes
+
+    for max_workers in (1, 2, 4, 8):
+        for cls in [ThreadPoolExecutor, ProcessPoolExecutor, InterpreterPoolExecutor]:
+            try:
+                executor = cls(max_workers)
+            except InterpretersNotSupported:
+                continue
+            with trace_time() as t:
+                with executor:
+                    for f in [executor.submit(fib, 24) for _ in range(CPU_N)]:
+                        f.result()
+            prefix = f"{cls_name(cls)} cpu[{max_workers}]"
+            print(f"{prefix:>51}: {t.result}")
+
+
+def stage(x):
+    return x + 1
+
+
+def resubmit(executor, stages, f):
+    # the way to build a pipeline without continuations
+    result: Future = Future()
+
+    def callback(prev, i=0):
+        if i == stages:
+            result.set_result(prev.result())
+        else:
+            executor.submit(stage, prev.result()).add_done_callback(
+                lambda f: callback(f, i + 1)
+            )
+
+    f.add_done_callback(callback)
+    return result
+
+
+def bench_pipeline():
+    pipelines = {
+        "resubmit": lambda executor, f: resubmit(executor, STAGES - 1, f),
+        "then": lambda executor, f: chain(f, *[stage] * (STAGES - 1)),
+        "then(inline=False)": lambda executor, f: chain(
+            f, *[stage] * (STAGES - 1), inline=False
+        ),
+    }
+    for max_workers in (1, 2, 4, 8):
+        for kind, pipeline in pipelines.items():
+            with nogc(), trace_time() as t:
+                with ThreadPoolExecutor(max_workers) as executor:
+                    fs = [
+                        pipeline(executor, executor.submit(stage, i))
+                        for i in range(PIPELINE_N)
+                    ]
+                    for f in fs:
+                        f.result()
+            prefix = f"pipeline[{max_workers}] {kind}"
+            print(f"{prefix:>51}: {t.result}")
+
+
+if __name__ == "__main__":
+    bench_submit()
+    bench_e2e()
+    bench_cpu()
+    bench_pipeline()
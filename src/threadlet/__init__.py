@@ -1,13 +1,22 @@
+import collections
 import itertools
+import pickle
 import queue
+import sys
 import threading
+import time
+import traceback
 import typing as t
 import weakref
 from dataclasses import dataclass, field
 from concurrent.futures import _base
 
+try:
+    from concurrent import interpreters  # type: ignore
+except ImportError:  # pragma: no cover
+    interpreters = None  # type: ignore
+
 # aliases
-Future = _base.Future
 wait = _base.wait
 as_completed = _base.as_completed
 
@@ -17,6 +26,137 @@ class DeadWorker(RuntimeError):
         super().__init__("Cannot submit new future: worker is down")
 
 
+class Future(_base.Future):
+    # weak reference to the worker or executor which has produced the future
+    _executor_ref: t.Optional[weakref.ref] = None
+    # set for futures returned by `then`
+    _is_stage = False
+    _upstream: t.Optional["Future"] = None
+    _dependents = 0
+
+    def then(self, fn: t.Callable, *, inline: bool = True) -> "Future":
+        """Returns a future of `fn` called with the result of this future.
+
+        By default `fn` runs right away on the thread which completes this future,
+        with `inline=False` it is submitted back to the same worker or executor
+        instead (or runs inline if it is already shut down).
+        Errors are propagated to the returned future and cancelling it cancels
+        the stages which haven't started yet and have no other dependents.
+        """
+        f = Future()
+        f._executor_ref = self._executor_ref
+        f._is_stage = True
+        f._upstream = self
+        with self._condition:
+            self._dependents += 1
+        self.add_done_callback(lambda prev: _trampoline(_continue, prev, f, fn, inline))
+        return f
+
+    def cancel(self) -> bool:
+        if not super().cancel():
+            return False
+        f = self
+        while True:
+            upstream, f._upstream = f._upstream, None
+            # futures which aren't created by `then` are never cancelled here
+            if upstream is None or not upstream._is_stage:
+                return True
+            with upstream._condition:
+                upstream._dependents -= 1
+                if upstream._dependents > 0:
+                    return True
+            if not _base.Future.cancel(upstream):
+                return True
+            f = upstream
+
+
+_local = threading.local()
+
+
+def _trampoline(fn: t.Callable, *args: t.Any) -> None:
+    # runs callbacks of chained futures one after another instead of nesting them,
+    # so the stack depth doesn't grow with the length of the chain
+    pending = getattr(_local, "pending", None)
+    if pending is not None:
+        pending.append((fn, args))
+        return
+    _local.pending = pending = collections.deque([(fn, args)])
+    try:
+        while pending:
+            fn, args = pending.popleft()
+            try:
+                fn(*args)
+            except Exception:
+                _base.LOGGER.exception("exception calling callback for %r", fn)
+    finally:
+        _local.pending = None
+
+
+def _continue(prev: _base.Future, f: Future, fn: t.Callable, inline: bool) -> None:
+    f._upstream = None
+    try:
+        exc = prev.exception()
+    except _base.CancelledError:
+        f.cancel()
+        return
+    if exc is not None:
+        if f.set_running_or_notify_cancel():
+            f.set_exception(exc)
+        return
+    task = Task(f, fn, (prev.result(),))
+    if not inline:
+        if f._executor_ref is None:
+            threading.Thread(target=task.run).start()
+            return
+        executor = f._executor_ref()
+        if executor is not None:
+            try:
+                executor._put(task)
+                return
+            except DeadWorker:
+                pass
+    _run_inline(task)
+
+
+def _run_inline(task: "Task") -> None:
+    w = threading.current_thread()
+    if not isinstance(w, Worker) or not w.watched:
+        _run_stage(task)
+        return
+    # let the watchdog see the stage instead of the task which has completed it
+    running = w._running
+    w._running = (task, time.monotonic())
+    try:
+        _run_stage(task)
+    finally:
+        w._running = (running[0], time.monotonic()) if running else None
+
+
+def _run_stage(task: "Task") -> None:
+    f = task.future
+    if not f.set_running_or_notify_cancel():
+        return
+    # callbacks are only deferred while `set_result`/`set_exception` dispatch them,
+    # so the stage itself can wait for other chains completing on this thread
+    pending, _local.pending = getattr(_local, "pending", None), None
+    try:
+        result = task.target(*task.args, **task.kwargs)
+    except BaseException as e:
+        _local.pending = pending
+        f.set_exception(e)
+        # Break a reference cycle with the exception 'exc'
+        task = f = None  # type: ignore
+    else:
+        _local.pending = pending
+        f.set_result(result)
+
+
+def chain(future: Future, *fns: t.Callable, inline: bool = True) -> Future:
+    for fn in fns:
+        future = future.then(fn, inline=inline)
+    return future
+
+
 @dataclass(frozen=True)
 class Task:
     future: Future
@@ -49,13 +189,30 @@ class Worker(threading.Thread):
     def __init__(self, q: queue.SimpleQueue = None, name=None, **kwargs: t.Any) -> None:
         super().__init__(name=name or f"Worker-{self.__class__._counter()}", **kwargs)
         self._queue = q or queue.SimpleQueue()
+        self._self_ref = weakref.ref(self)
         self._future: Future = Future()
+        self._stop_lock = threading.Lock()
+        self._is_stopping = False
+        self._running: t.Optional[t.Tuple[Task, float]] = None
+        # current task and its start time are only recorded for watched workers
+        self.watched = False
         self.on_idle: t.Optional[t.Callable] = None
 
     @property
     def future(self) -> Future:
         return self._future
 
+    @property
+    def current_task(self) -> t.Optional[Task]:
+        running = self._running
+        return running[0] if running else None
+
+    @property
+    def task_started(self) -> t.Optional[float]:
+        """`time.monotonic()` at which the current task has been started."""
+        running = self._running
+        return running[1] if running else None
+
     def __enter__(self) -> "Worker":
         self.start()
         return self
@@ -73,7 +230,12 @@ class Worker(threading.Thread):
                 task = self._get_task()
                 if task is None:
                     break
-                task.run()
+                if self.watched:
+                    self._running = (task, time.monotonic())
+                    task.run()
+                    self._running = None
+                else:
+                    task.run()
                 del task
         except BaseException as e:
             self._future.set_exception(e)
@@ -91,29 +253,170 @@ class Worker(threading.Thread):
             return self._queue.get()
 
     def submit(self, target: t.Callable, /, *args: t.Any, **kwargs: t.Any) -> Future:
-        if not self.is_alive():
-            raise DeadWorker
-        f: Future = Future()
-        self._queue.put(Task(f, target, args, kwargs))
+        f = Future()
+        f._executor_ref = self._self_ref
+        self._put(Task(f, target, args, kwargs))
         return f
 
+    def _put(self, task: Task) -> None:
+        with self._stop_lock:
+            if self._is_stopping or not self.is_alive():
+                raise DeadWorker
+            self._queue.put(task)
+
     def stop(self) -> None:
-        if self.is_alive():
-            self._queue.put(None)
+        with self._stop_lock:
+            if self.is_alive() and not self._is_stopping:
+                self._is_stopping = True
+                self._queue.put(None)
 
 
-def _stop_workers(workers, wait=True) -> None:
-    for w in workers:
+@dataclass(frozen=True)
+class Stall:
+    worker: Worker
+    task: Task
+    elapsed: float
+    stack: t.List[str]
+
+    @property
+    def target(self) -> t.Callable:
+        if self.task.target is _interpreter_call:
+            # unwrap the function submitted to `InterpreterPoolExecutor`
+            return next(iter(self.task.args))
+        return self.task.target
+
+
+def report_stall(stall: Stall) -> None:
+    _base.LOGGER.warning(
+        "Worker %r is running %r for %.2fs:\n%s",
+        stall.worker.name,
+        stall.target,
+        stall.elapsed,
+        "".join(stall.stack),
+    )
+
+
+class Watchdog(threading.Thread):
+    """Reports workers which are running the same task longer than `timeout` seconds."""
+
+    _counter = itertools.count().__next__
+
+    def __init__(
+        self,
+        workers: t.Set[Worker],
+        timeout: float,
+        *,
+        interval: float = None,
+        on_stall: t.Callable[[Stall], t.Any] = report_stall,
+        on_recover: t.Optional[t.Callable[[Worker], t.Any]] = None,
+        name: str = None,
+    ) -> None:
+        if timeout <= 0:
+            raise ValueError("timeout must be greater than 0")
+        super().__init__(
+            name=name or f"Watchdog-{self.__class__._counter()}", daemon=True
+        )
+        for w in workers:
+            w.watched = True
+        self._workers = workers
+        self._timeout = timeout
+        self._interval = interval or timeout / 2
+        self._stopped = threading.Event()
+        self._stalled: t.Dict[Worker, Task] = {}
+        self.on_stall = on_stall
+        self.on_recover = on_recover
+
+    def __enter__(self) -> "Watchdog":
+        self.start()
+        return self
+
+    def __exit__(self, *_) -> t.Any:
+        self.stop()
+        self.join()
+        return False
+
+    def run(self) -> None:
+        while not self._stopped.wait(self._interval):
+            self.check()
+
+    def check(self) -> None:
+        now = time.monotonic()
+        workers = tuple(self._workers)
+        for w, task in tuple(self._stalled.items()):
+            if w.current_task is not task or w not in workers:
+                del self._stalled[w]
+                if self.on_recover:
+                    self._call(self.on_recover, w)
+        frames = None
+        for w in workers:
+            w.watched = True
+            running = w._running
+            if running is None or w in self._stalled:
+                continue
+            task, started = running
+            if now - started < self._timeout:
+                continue
+            if frames is None:
+                frames = sys._current_frames()
+            frame = frames.get(w.ident)  # type: ignore
+            stack = traceback.format_stack(frame) if frame else []
+            self._stalled[w] = task
+            self._call(self.on_stall, Stall(w, task, now - started, stack))
+        del frames
+
+    @staticmethod
+    def _call(callback: t.Callable, arg: t.Any) -> None:
+        # an error in a callback must not stop watching
+        try:
+            callback(arg)
+        except Exception:
+            _base.LOGGER.exception("exception calling watchdog callback %r", callback)
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+
+def _stop_workers(workers, wait=True, watchdog: t.Optional[Watchdog] = None) -> None:
+    if watchdog is not None:
+        watchdog.stop()
+    for w in tuple(workers):
         if w.is_alive():
             w.stop()
     if wait:
-        _base.wait((w.future for w in workers))
+        _join_workers(workers, watchdog)
+
+
+def _join_workers(workers, watchdog: t.Optional[Watchdog] = None) -> None:
+    if watchdog is not None:
+        if watchdog.is_alive() and watchdog is not threading.current_thread():
+            watchdog.join()
+    _base.wait(tuple(w.future for w in tuple(workers)))
+
+
+def _on_stall(executor_ref, stall: Stall) -> None:
+    self = executor_ref()
+    if self:
+        self._on_stall(stall)
+
+
+def _on_recover(executor_ref, w: Worker) -> None:
+    self = executor_ref()
+    if self:
+        self._on_recover(w)
 
 
 class SimpleThreadPoolExecutor(_base.Executor):
     _counter = itertools.count().__next__
+    _worker_class: t.Type[Worker] = Worker
 
-    def __init__(self, max_workers: int, *, name: str = None) -> None:
+    def __init__(
+        self,
+        max_workers: int,
+        *,
+        name: str = None,
+        stall_timeout: float = None,
+        on_stall: t.Callable[[Stall], t.Any] = report_stall,
+    ) -> None:
         if max_workers <= 0:
             raise ValueError("max_workers must be greater than 0")
         self._max_workers = max_workers
@@ -122,30 +425,62 @@ class SimpleThreadPoolExecutor(_base.Executor):
         self._workers: t.Set[Worker] = set()
         self._shutdown_lock = threading.Lock()
         self._is_down = False
-        weakref.finalize(self, _stop_workers, self._workers, True)
+        self._stall_callback = on_stall
+        self._watchdog: t.Optional[Watchdog] = None
+        if stall_timeout is not None:
+            self_ref = weakref.ref(self)
+            self._watchdog = Watchdog(
+                self._workers,
+                stall_timeout,
+                on_stall=lambda stall: _on_stall(self_ref, stall),
+                on_recover=lambda w: _on_recover(self_ref, w),
+                name=f"{self._name}-Watchdog",
+            )
+        self._self_ref = weakref.ref(self)
+        weakref.finalize(self, _stop_workers, self._workers, True, self._watchdog)
 
     @property
     def workers(self) -> t.Set[Worker]:
         return self._workers
 
     def __enter__(self) -> "SimpleThreadPoolExecutor":
-        for i in range(self._max_workers):
-            w = Worker(self._queue, name=f"{self._name}-Worker-{i}")
-            self._workers.add(w)
-            w.start()
+        try:
+            for i in range(self._max_workers):
+                w = self._worker_class(self._queue, name=f"{self._name}-Worker-{i}")
+                w.watched = self._watchdog is not None
+                w.start()
+                self._workers.add(w)
+        except BaseException:
+            self.shutdown(wait=True)
+            raise
+        self._start_watchdog()
         return self
 
     def __exit__(self, *_) -> t.Any:
         self.shutdown(wait=True)
         return False
 
+    def _start_watchdog(self) -> None:
+        if self._watchdog is not None and not self._watchdog.is_alive():
+            self._watchdog.start()
+
+    def _on_stall(self, stall: Stall) -> None:
+        self._stall_callback(stall)
+
+    def _on_recover(self, w: Worker) -> None:
+        pass
+
     def submit(self, target: t.Callable, /, *args: t.Any, **kwargs: t.Any) -> Future:
+        f = Future()
+        f._executor_ref = self._self_ref
+        self._put(Task(f, target, args, kwargs))
+        return f
+
+    def _put(self, task: Task) -> None:
         with self._shutdown_lock:
             if self._is_down:
                 raise DeadWorker
-            f: Future = Future()
-            self._queue.put(Task(f, target, args, kwargs))
-            return f
+            self._queue.put(task)
 
     def shutdown(self, wait=True, *, cancel_futures=False) -> None:
         with self._shutdown_lock:
@@ -160,7 +495,10 @@ class SimpleThreadPoolExecutor(_base.Executor):
                         break
                     if item is not None:
                         item.future.cancel()
-            _stop_workers(self._workers, wait=wait)
+            _stop_workers(self._workers, wait=False, watchdog=self._watchdog)
+        # waiting outside the lock lets running tasks and the watchdog use it
+        if wait:
+            _join_workers(self._workers, self._watchdog)
 
 
 class TempWorker(Worker):
@@ -203,24 +541,38 @@ def _inc_idle_workers(executor_ref) -> None:
 
 
 class ThreadPoolExecutor(SimpleThreadPoolExecutor):
+    _temp_worker_class: t.Type[TempWorker] = TempWorker
+
     def __init__(
         self,
         max_workers: int = None,
         *,
         idle_timeout=TempWorker.IDLE_TIMEOUT,
         name: str = None,
+        stall_timeout: float = None,
+        on_stall: t.Callable[[Stall], t.Any] = report_stall,
+        replace_stalled: bool = True,
     ) -> None:
-        super().__init__(max_workers or self.get_default_max_workers(), name=name)
+        super().__init__(
+            max_workers or self.get_default_max_workers(),
+            name=name,
+            stall_timeout=stall_timeout,
+            on_stall=on_stall,
+        )
         self._idle_timeout = idle_timeout
         self._idle_lock = threading.Lock()
         self._idle_workers = 0
+        self._replace_stalled = replace_stalled
+        self._stalled_workers = 0
 
     def __enter__(self) -> "ThreadPoolExecutor":
-        w = Worker(self._queue, name=f"{self._name}-Worker-0")
+        w = self._worker_class(self._queue, name=f"{self._name}-Worker-0")
+        w.watched = self._watchdog is not None
         self_ref = weakref.ref(self)
         w.on_idle = lambda: _inc_idle_workers(self_ref)
-        self._workers.add(w)
         w.start()
+        self._workers.add(w)
+        self._start_watchdog()
         return self
 
     @classmethod
@@ -235,30 +587,209 @@ class ThreadPoolExecutor(SimpleThreadPoolExecutor):
     def set_idle_timeout(self, timeout: int) -> None:
         self._idle_timeout = timeout
 
-    def submit(self, target: t.Callable, /, *args: t.Any, **kwargs: t.Any) -> Future:
+    def _put(self, task: Task) -> None:
         with self._shutdown_lock:
             if self._is_down:
                 raise DeadWorker
 
-            f: Future = Future()
-            self._queue.put(Task(f, target, args, kwargs))
+            self._queue.put(task)
 
             with self._idle_lock:
-                if len(self._workers) < self._max_workers and self._idle_workers == 0:
-                    w = TempWorker(
-                        self._queue,
-                        idle_timeout=self._idle_timeout,
-                        name=f"{self._name}-TempWorker-{len(self._workers)}",
-                    )
-                    self_ref = weakref.ref(self)
-                    w.on_idle = lambda: _inc_idle_workers(self_ref)
-                    w.future.add_done_callback(lambda _: _discard_worker(self_ref, w))
-                    self._workers.add(w)
-                    w.start()
+                if self._can_spawn_worker():
+                    try:
+                        self._spawn_temp_worker()
+                    except Exception:
+                        # the task is queued, so the running workers will handle it
+                        _base.LOGGER.exception(
+                            "failed to spawn a worker in %s", self._name
+                        )
                 elif self._idle_workers > 0:
                     self._idle_workers -= 1
 
-            return f
+    def _can_spawn_worker(self) -> bool:
+        # stalled workers are not counted, so they cannot drain the whole pool
+        busy = len(self._workers) - self._stalled_workers
+        return busy < self._max_workers and self._idle_workers == 0
+
+    def _spawn_temp_worker(self) -> None:
+        w = self._temp_worker_class(
+            self._queue,
+            idle_timeout=self._idle_timeout,
+            name=f"{self._name}-TempWorker-{len(self._workers)}",
+        )
+        w.watched = self._watchdog is not None
+        self_ref = weakref.ref(self)
+        w.on_idle = lambda: _inc_idle_workers(self_ref)
+        w.future.add_done_callback(lambda _: _discard_worker(self_ref, w))
+        w.start()
+        self._workers.add(w)
+
+    def _on_stall(self, stall: Stall) -> None:
+        if self._replace_stalled:
+            with self._shutdown_lock, self._idle_lock:
+                self._stalled_workers += 1
+                if not self._is_down and self._can_spawn_worker():
+                    self._spawn_temp_worker()
+        super()._on_stall(stall)
+
+    def _on_recover(self, w: Worker) -> None:
+        if self._replace_stalled:
+            with self._idle_lock:
+                self._stalled_workers -= 1
+
+
+class InterpretersNotSupported(RuntimeError):
+    def __init__(self) -> None:
+        super().__init__("Cannot create subinterpreters: not supported by this runtime")
+
+
+@dataclass(frozen=True)
+class _SharedRef:
+    name: str
+
+
+def _share(obj: t.Any, shared: t.Dict[str, t.Any]) -> t.Any:
+    if isinstance(obj, memoryview):
+        name = f"_threadlet_shared_{len(shared)}"
+        shared[name] = obj
+        return _SharedRef(name)
+    return obj
+
+
+def _resolve(obj: t.Any) -> t.Any:
+    if isinstance(obj, _SharedRef):
+        return getattr(sys.modules["__main__"], obj.name)
+    return obj
+
+
+@dataclass(frozen=True)
+class _Raised:
+    exc: BaseException
+
+
+def _call_shared(
+    target: t.Callable, args: t.Tuple, kwargs: t.Dict[str, t.Any]
+) -> t.Any:
+    # runs inside the subinterpreter
+    args = tuple(_resolve(a) for a in args)
+    kwargs = {k: _resolve(v) for k, v in kwargs.items()}
+    try:
+        return target(*args, **kwargs)
+    except Exception as e:
+        try:
+            pickle.loads(pickle.dumps(e))
+        except Exception:
+            # comes back as `concurrent.interpreters.ExecutionFailed`
+            raise e from None
+        # passed back as a result, so the caller gets the original type
+        return _Raised(e)
+
+
+def _interpreter_call(
+    target: t.Callable, args: t.Tuple, kwargs: t.Dict[str, t.Any]
+) -> t.Any:
+    interp = threading.current_thread().interpreter  # type: ignore
+    # memoryviews are bound into the subinterpreter's __main__ without copying,
+    # everything else is pickled by `Interpreter.call`
+    shared: t.Dict[str, t.Any] = {}
+    args = tuple(_share(a, shared) for a in args)
+    kwargs = {k: _share(v, shared) for k, v in kwargs.items()}
+    if shared:
+        interp.prepare_main(shared)
+    try:
+        result = interp.call(_call_shared, target, args, kwargs)
+    finally:
+        if shared:
+            interp.prepare_main(dict.fromkeys(shared))
+    if isinstance(result, _Raised):
+        raise result.exc
+    return result
+
+
+def _create_interpreter() -> t.Any:
+    if interpreters is None:
+        raise InterpretersNotSupported
+    interp = interpreters.create()
+    try:
+        # make the same modules importable as in the main interpreter
+        interp.prepare_main(path=tuple(sys.path))
+        interp.exec("import sys; sys.path[:] = path; del path")
+    except BaseException:
+        interp.close()
+        raise
+    return interp
+
+
+class _InterpreterWorkerMixin:
+    interpreter: t.Any = None
+
+    def start(self) -> None:
+        # created by the starting thread, so a failure is raised to the caller
+        # instead of leaving a dead worker behind
+        self.interpreter = _create_interpreter()
+        try:
+            super().start()  # type: ignore
+        except BaseException:
+            self.interpreter.close()
+            self.interpreter = None
+            raise
+
+    def run(self) -> None:
+        try:
+            super().run()  # type: ignore
+        finally:
+            self.interpreter.close()
+            self.interpreter = None
+
+
+class InterpreterWorker(_InterpreterWorkerMixin, Worker):
+    pass
+
+
+class TempInterpreterWorker(_InterpreterWorkerMixin, TempWorker):
+    pass
+
+
+class InterpreterPoolExecutor(ThreadPoolExecutor):
+    _counter = itertools.count().__next__
+    _worker_class = InterpreterWorker
+    _temp_worker_class = TempInterpreterWorker
+
+    def __init__(
+        self,
+        max_workers: int = None,
+        *,
+        idle_timeout=TempWorker.IDLE_TIMEOUT,
+        name: str = None,
+        stall_timeout: float = None,
+        on_stall: t.Callable[[Stall], t.Any] = report_stall,
+        replace_stalled: bool = True,
+    ) -> None:
+        if interpreters is None:
+            raise InterpretersNotSupported
+        super().__init__(
+            max_workers,
+            idle_timeout=idle_timeout,
+            name=name or f"InterpreterPool-{self.__class__._counter()}",
+            stall_timeout=stall_timeout,
+            on_stall=on_stall,
+            replace_stalled=replace_stalled,
+        )
+
+    @classmethod
+    def get_default_max_workers(cls) -> int:
+        import os
+
+        return os.cpu_count() or 1
+
+    def _put(self, task: Task) -> None:
+        super()._put(
+            Task(
+                task.future,
+                _interpreter_call,
+                (task.target, tuple(task.args), task.kwargs),
+            )
+        )
 
 
 _executor: t.Optional[ThreadPoolExecutor] = None
@@ -0,0 +1,21 @@
+# Functions submitted to subinterpreters are imported there by name,
+# so they live in a module which doesn't import pytest.
+import threading
+
+
+def add(x, y):
+    return x + y
+
+
+def checksum(buf):
+    return sum(buf)
+
+
+def fail():
+    raise ValueError
+
+
+def fail_unpicklable():
+    e = ValueError()
+    e.lock = threading.Lock()
+    raise e
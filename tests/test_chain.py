@@ -0,0 +1,203 @@
+import threading
+import time
+
+import pytest
+
+from threadlet import (
+    SimpleThreadPoolExecutor,
+    ThreadPoolExecutor,
+    Worker,
+    DeadWorker,
+    Future,
+    chain,
+    spawn,
+)
+
+
+def inc(x):
+    return x + 1
+
+
+def current_thread(_):
+    return threading.current_thread()
+
+
+def slow_inc(x):
+    time.sleep(0.2)
+    return x + 1
+
+
+def block(event):
+    event.wait()
+    return 1
+
+
+def fail():
+    raise ValueError
+
+
+@pytest.mark.parametrize("inline", (True, False))
+def test_then_success(inline):
+    with ThreadPoolExecutor(2) as tpe:
+        f = tpe.submit(inc, 0).then(inc, inline=inline).then(inc, inline=inline)
+        assert f.result() == 3
+        assert chain(tpe.submit(inc, 0), inc, inc, inc, inline=inline).result() == 4
+
+
+def test_then_runs_inline_on_completing_worker():
+    with SimpleThreadPoolExecutor(4) as tpe:
+        f = tpe.submit(threading.current_thread)
+        stage = f.then(current_thread)
+        assert stage.result() is f.result()
+
+
+@pytest.mark.parametrize("inline", (True, False))
+def test_then_spawned_future(inline):
+    assert spawn(inc, 0).then(inc, inline=inline).result() == 2
+
+
+@pytest.mark.parametrize("inline", (True, False))
+def test_then_error(error_class, inline):
+    def fail(_):
+        error_class.throw()
+
+    called = []
+    with Worker() as w:
+        f = chain(
+            w.submit(error_class.throw), called.append, called.append, inline=inline
+        )
+        with pytest.raises(error_class):
+            f.result()
+        f = w.submit(inc, 0).then(fail, inline=inline).then(called.append)
+        with pytest.raises(error_class):
+            f.result()
+    assert called == []
+
+
+def test_then_cancel_chain():
+    event = threading.Event()
+    called = []
+    with Worker() as w:
+        w.submit(event.wait)
+        first = w.submit(inc, 0)
+        second = first.then(called.append)
+        last = second.then(called.append)
+        assert last.cancel()
+        assert second.cancelled()
+        # the future returned by `submit` is never cancelled by its stages
+        assert not first.cancelled()
+        event.set()
+        assert first.result() == 1
+    assert called == []
+
+
+def test_then_cancel_fan_out():
+    event = threading.Event()
+    with Worker() as w:
+        w.submit(event.wait)
+        base = w.submit(inc, 0)
+        stage = base.then(inc)
+        a = stage.then(inc)
+        b = stage.then(inc)
+        assert a.cancel()
+        assert not stage.cancelled() and not b.cancelled()
+        assert b.cancel()
+        assert stage.cancelled() and not base.cancelled()
+        event.set()
+        assert base.result() == 1
+
+
+def test_then_cancel_pending_stage():
+    event = threading.Event()
+    called = []
+    with Worker() as w:
+        first = w.submit(event.wait)
+        time.sleep(0.1)
+        last = first.then(called.append).then(called.append)
+        assert last.cancel()
+        assert not first.cancelled()
+        event.set()
+        assert first.result() is True
+    assert called == []
+
+
+def test_then_cancel_queued_stages():
+    event = threading.Event()
+    called = []
+    with Worker() as w:
+        done = w.submit(inc, -1)
+        assert done.result() == 0
+        w.submit(event.wait)
+        first = done.then(called.append, inline=False)
+        second = first.then(called.append, inline=False)
+        cancelled = second.cancel()
+        event.set()
+    assert cancelled
+    assert first.cancelled() and not done.cancelled()
+    assert called == []
+
+
+def nested_then(x):
+    done = Future()
+    done.set_result(x)
+    return done.then(inc).result(timeout=2)
+
+
+def test_then_nested_chain():
+    with ThreadPoolExecutor(2) as tpe:
+        assert chain(tpe.submit(inc, 0), nested_then, nested_then).result() == 3
+
+        def nested_submit(x):
+            return tpe.submit(inc, x).then(inc).result(timeout=2)
+
+        assert tpe.submit(inc, 0).then(nested_submit).result() == 3
+
+
+def test_then_dead_worker():
+    w = Worker()
+    with w:
+        f = w.submit(inc, 0)
+        f.result()
+    with pytest.raises(DeadWorker):
+        w.submit(inc, 0)
+    # a stage which can't be queued anymore runs inline
+    assert f.then(inc, inline=False).result() == 2
+
+
+@pytest.mark.parametrize(
+    "executor_class", [Worker, SimpleThreadPoolExecutor, ThreadPoolExecutor]
+)
+def test_then_shutdown_while_stage_running(executor_class):
+    event = threading.Event()
+    args = () if executor_class is Worker else (1,)
+    with executor_class(*args) as executor:
+        first = executor.submit(block, event)
+        f = first.then(inc, inline=False).then(inc, inline=False)
+        spawn(lambda: time.sleep(0.2) or event.set())
+    assert f.result(timeout=5) == 3
+
+
+def test_then_long_chain():
+    event = threading.Event()
+    with Worker() as w:
+        first = w.submit(block, event)
+        f = chain(first, *[inc] * 1000)
+        event.set()
+        assert f.result(timeout=5) == 1001
+        f = chain(w.submit(fail), *[inc] * 1000)
+        with pytest.raises(ValueError):
+            f.result(timeout=5)
+
+
+def test_then_stall_timeout():
+    stalls = []
+    with ThreadPoolExecutor(
+        1, stall_timeout=0.3, on_stall=stalls.append, replace_stalled=False
+    ) as tpe:
+        f = chain(tpe.submit(inc, 0), slow_inc, slow_inc, slow_inc)
+        assert f.result() == 4
+        assert stalls == []
+        f = tpe.submit(inc, 0).then(lambda x: time.sleep(0.5) or x)
+        assert f.result() == 1
+    assert len(stalls) == 1
+    assert stalls[0].task.future is f
@@ -0,0 +1,92 @@
+import threading
+
+import pytest
+
+import threadlet
+from threadlet import InterpreterPoolExecutor, InterpretersNotSupported
+
+from .interpreter_targets import add, checksum, fail, fail_unpicklable
+
+requires_interpreters = pytest.mark.skipif(
+    threadlet.interpreters is None, reason="subinterpreters are not supported"
+)
+
+
+class InterpreterError(Exception):
+    pass
+
+
+def fail_create_interpreter():
+    raise InterpreterError
+
+
+@pytest.mark.skipif(
+    threadlet.interpreters is not None, reason="subinterpreters are supported"
+)
+def test_interpreter_executor_not_supported():
+    with pytest.raises(InterpretersNotSupported):
+        InterpreterPoolExecutor(1)
+
+
+@requires_interpreters
+def test_interpreter_executor_submit_success():
+    initial_threads_count = threading.active_count()
+    with InterpreterPoolExecutor(2, idle_timeout=1) as ipe:
+        assert threading.active_count() == initial_threads_count + 1
+        assert ipe.submit(add, 1, 2).result() == 3
+        assert list(ipe.map(add, [1, 2], [3, 4])) == [4, 6]
+    assert threading.active_count() == initial_threads_count
+
+
+@requires_interpreters
+def test_interpreter_executor_shared_buffer():
+    data = bytearray(range(256))
+    with InterpreterPoolExecutor(1) as ipe:
+        assert ipe.submit(checksum, memoryview(data)).result() == sum(data)
+        assert ipe.submit(checksum, buf=memoryview(data)).result() == sum(data)
+
+
+@requires_interpreters
+def test_interpreter_executor_submit_error():
+    with InterpreterPoolExecutor(1) as ipe:
+        with pytest.raises(ValueError):
+            ipe.submit(fail).result()
+        with pytest.raises(threadlet.interpreters.ExecutionFailed):
+            ipe.submit(fail_unpicklable).result()
+        assert ipe.submit(add, 1, 1).result() == 2
+
+
+def test_interpreter_executor_create_error(monkeypatch):
+    monkeypatch.setattr(threadlet, "interpreters", object())
+    monkeypatch.setattr(threadlet, "_create_interpreter", fail_create_interpreter)
+    initial_threads_count = threading.active_count()
+    for max_workers in (1, 2):
+        with pytest.raises(InterpreterError):
+            with InterpreterPoolExecutor(max_workers):
+                pass
+    assert threading.active_count() == initial_threads_count
+
+
+def test_interpreter_executor_spawn_error(monkeypatch, caplog):
+    class Interpreter:
+        def call(self, fn, *args):
+            return fn(*args)
+
+        def close(self):
+            pass
+
+    created = []
+
+    def create_interpreter():
+        if created:
+            raise InterpreterError
+        created.append(Interpreter())
+        return created[0]
+
+    monkeypatch.setattr(threadlet, "interpreters", object())
+    monkeypatch.setattr(threadlet, "_create_interpreter", create_interpreter)
+    with InterpreterPoolExecutor(2) as ipe:
+        fs = [ipe.submit(add, i, 1) for i in range(3)]
+        assert [f.result() for f in fs] == [1, 2, 3]
+    assert len(created) == 1
+    assert "failed to spawn a worker" in caplog.text
@@ -0,0 +1,142 @@
+import threading
+import time
+
+import pytest
+
+import threadlet
+from threadlet import (
+    InterpreterPoolExecutor,
+    SimpleThreadPoolExecutor,
+    ThreadPoolExecutor,
+    Watchdog,
+    Worker,
+)
+
+
+def block(event):
+    event.wait()
+
+
+def test_worker_current_task():
+    event = threading.Event()
+    with Worker() as w:
+        w.watched = True
+        assert w.current_task is None and w.task_started is None
+        f = w.submit(block, event)
+        time.sleep(0.1)
+        assert w.current_task.future is f
+        assert w.task_started <= time.monotonic()
+        event.set()
+        f.result()
+        time.sleep(0.1)
+        assert w.current_task is None and w.task_started is None
+
+
+def test_watchdog_stall_and_recover():
+    stalls = []
+    recovered = []
+    event = threading.Event()
+    with Worker() as w:
+        with Watchdog({w}, 0.2, on_stall=stalls.append, on_recover=recovered.append):
+            f = w.submit(block, event)
+            time.sleep(0.5)
+            assert len(stalls) == 1
+            stall = stalls[0]
+            assert stall.worker is w
+            assert stall.task.future is f
+            assert stall.target is block
+            assert stall.elapsed >= 0.2
+            assert "block" in "".join(stall.stack)
+            event.set()
+            f.result()
+            time.sleep(0.3)
+            assert recovered == [w]
+    assert len(stalls) == 1
+
+
+def test_worker_not_watched():
+    event = threading.Event()
+    with Worker() as w:
+        w.submit(block, event)
+        time.sleep(0.1)
+        assert w.current_task is None
+        event.set()
+
+
+def test_watchdog_callback_error(caplog):
+    stalls = []
+
+    def on_stall(stall):
+        stalls.append(stall)
+        raise RuntimeError("on_stall")
+
+    events = [threading.Event(), threading.Event()]
+    with Worker() as w1, Worker() as w2:
+        with Watchdog({w1, w2}, 0.2, on_stall=on_stall) as watchdog:
+            w1.submit(block, events[0])
+            time.sleep(0.5)
+            assert len(stalls) == 1
+            w2.submit(block, events[1])
+            time.sleep(0.5)
+            assert len(stalls) == 2
+            assert watchdog.is_alive()
+            for event in events:
+                event.set()
+    assert "exception calling watchdog callback" in caplog.text
+    assert "RuntimeError: on_stall" in caplog.text
+
+
+def test_watchdog_invalid_timeout():
+    with pytest.raises(ValueError):
+        Watchdog(set(), 0)
+
+
+def test_simple_executor_stall_report():
+    stalls = []
+    event = threading.Event()
+    with SimpleThreadPoolExecutor(1, stall_timeout=0.2, on_stall=stalls.append) as tpe:
+        f = tpe.submit(block, event)
+        time.sleep(0.5)
+        assert [s.task.future for s in stalls] == [f]
+        event.set()
+
+
+@pytest.mark.parametrize("replace_stalled", (True, False))
+def test_executor_replace_stalled(expected_result, replace_stalled):
+    initial_threads_count = threading.active_count()
+    event = threading.Event()
+    with ThreadPoolExecutor(
+        1,
+        idle_timeout=1,
+        stall_timeout=0.2,
+        on_stall=lambda _: None,
+        replace_stalled=replace_stalled,
+    ) as tpe:
+        tpe.submit(block, event)
+        f = tpe.submit(lambda: expected_result)
+        time.sleep(0.5)
+        assert f.done() is replace_stalled
+        event.set()
+        assert f.result() is expected_result
+    assert threading.active_count() == initial_threads_count
+
+
+def test_report_stall(caplog):
+    event = threading.Event()
+    with SimpleThreadPoolExecutor(1, stall_timeout=0.2) as tpe:
+        tpe.submit(block, event)
+        time.sleep(0.5)
+        event.set()
+    assert "is running" in caplog.text and "block" in caplog.text
+
+
+@pytest.mark.skipif(
+    threadlet.interpreters is None, reason="subinterpreters are not supported"
+)
+def test_interpreter_executor_stall_target():
+    stalls = []
+    with InterpreterPoolExecutor(
+        1, stall_timeout=0.2, on_stall=stalls.append, replace_stalled=False
+    ) as ipe:
+        ipe.submit(time.sleep, 0.5).result()
+    assert [s.target for s in stalls] == [time.sleep]